@@ -1,8 +1,14 @@
 import rasterio
+from affine import Affine
+from rasterio import windows
+from rasterio.crs import CRS
 from rasterio.warp import reproject, Resampling
 import numpy as np
 import os
 import csv
+import json
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 
 # Configuration
 REFERENCE_PATH = 'reference_10m.tif'  # 10m reference raster
@@ -15,76 +21,193 @@ OUTPUT_DIR = 'output'  # Directory to save results
 INUNDATED_VALUE = 1  # Pixel value indicating inundation
 NODATA_CLASS = 255  # NoData value for output classification rasters
 
+# Output class for each (reference, coarse) 2-bit state:
+# 0 = dry in both, 1 = coarse only (FP), 2 = reference only (FN), 3 = both (TP)
+CLASS_LUT = np.array([NODATA_CLASS, 3, 2, 1], dtype=np.uint8)
+
+
+def classify(ref_mask, coarse_mask):
+    """Classifies pixels as TP (1), FN (2) and FP (3) and returns the raster with its counts."""
+    # Encode (reference, coarse) as a 2-bit state; bool and uint8 share a layout, so views avoid casts
+    state = np.left_shift(ref_mask.view(np.uint8), 1)
+    np.bitwise_or(state, coarse_mask.view(np.uint8), out=state)
+
+    # One scratch mask is reused for all three counts
+    hits = np.empty(state.shape, dtype=bool)
+    tp_count = np.count_nonzero(np.equal(state, 3, out=hits))
+    fn_count = np.count_nonzero(np.equal(state, 2, out=hits))
+    fp_count = np.count_nonzero(np.equal(state, 1, out=hits))
+
+    # Map the states through the lookup table in place
+    classification = np.take(CLASS_LUT, state, out=state)
+    return classification, tp_count, fn_count, fp_count
+
+
+def is_aligned(coarse_dst, ref_profile):
+    """Checks whether the coarse raster is a pure rescaling of the reference grid (same CRS, orientation and origin)."""
+    ref_transform = ref_profile['transform']
+    coarse_transform = coarse_dst.transform
+    return (coarse_dst.crs == ref_profile['crs']
+            and ref_transform.b == ref_transform.d == coarse_transform.b == coarse_transform.d == 0
+            and ref_transform.a * coarse_transform.a > 0 and ref_transform.e * coarse_transform.e > 0
+            and ref_transform.c == coarse_transform.c and ref_transform.f == coarse_transform.f)
+
+
+def nearest_indices(offset, size, ref_step, coarse_step, coarse_size):
+    """Returns the coarse pixel index under each reference pixel centre and whether it falls inside the coarse raster."""
+    # Small epsilon matches GDAL's nearest-neighbour rounding for centres on a coarse pixel edge
+    indices = np.floor((np.arange(offset, offset + size) + 0.5) * (ref_step / coarse_step) + 1e-10).astype(np.intp)
+    inside = (indices >= 0) & (indices < coarse_size)
+    return np.clip(indices, 0, coarse_size - 1), inside
+
+
+def cache_tif_as_memmap(path, cache_dir):
+    """Caches band 1 of a GeoTIFF as a raw .npy file in cache_dir and returns it memory-mapped, together with its profile."""
+    array_path = os.path.join(cache_dir, os.path.basename(path) + '.npy')
+    profile_path = os.path.join(cache_dir, os.path.basename(path) + '.json')
+
+    # The cache belongs to this exact file: unzip and copies keep old mtimes, so compare the
+    # path, size and nanosecond mtime rather than checking that the cache is newer
+    stat = os.stat(path)
+    source = {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    # The sidecar is only written once the array is complete
+    if os.path.exists(array_path) and os.path.exists(profile_path):
+        with open(profile_path) as f:
+            sidecar = json.load(f)
+        if sidecar.get('source') == source:
+            profile = sidecar['profile']
+            profile['crs'] = CRS.from_wkt(profile['crs'])
+            profile['transform'] = Affine(*profile['transform'])
+            return np.load(array_path, mmap_mode='r'), profile
+
+    # First run: copy the raster block by block into a temporary file, so an interrupted
+    # run never leaves a partial cache under the final name
+    with rasterio.open(path) as src:
+        profile = src.profile
+        cache = np.lib.format.open_memmap(array_path + '.tmp', mode='w+', dtype=src.dtypes[0],
+                                          shape=(src.height, src.width))
+        for _, window in src.block_windows(1):
+            cache[window.toslices()] = src.read(1, window=window)
+        cache.flush()
+        del cache
+    os.replace(array_path + '.tmp', array_path)
+
+    # Sidecar keeps the source identity and the georeferencing needed to write outputs on the same grid
+    with open(profile_path + '.tmp', 'w') as f:
+        json.dump({'source': source,
+                   'profile': dict(profile, crs=profile['crs'].to_wkt(), transform=list(profile['transform'])[:6])}, f)
+    os.replace(profile_path + '.tmp', profile_path)
+
+    return np.load(array_path, mmap_mode='r'), profile
+
+
+def load_coarse(coarse_path, ref_profile):
+    """Reads a coarse raster and everything needed to resample it block by block onto the reference grid."""
+    with rasterio.open(coarse_path) as coarse_dst:
+        coarse = {
+            'array': coarse_dst.read(1),
+            'transform': coarse_dst.transform,
+            'crs': coarse_dst.crs,
+            'height': coarse_dst.height,
+            'width': coarse_dst.width,
+            'nodata': coarse_dst.nodata if coarse_dst.nodata is not None else -9999,
+            'aligned': is_aligned(coarse_dst, ref_profile)
+        }
+
+    # Integer classes fit in uint8; float rasters stay float so GDAL does not round values such as 0.6 to 1
+    if np.issubdtype(coarse['array'].dtype, np.integer):
+        coarse['resampled_dtype'], coarse['resampled_nodata'] = np.uint8, NODATA_CLASS
+    else:
+        coarse['resampled_dtype'], coarse['resampled_nodata'] = np.float32, -9999
+
+    # Aligned grids need no warp: nearest neighbour is a row/column lookup into the coarse mask
+    if coarse['aligned']:
+        coarse['inundated'] = (coarse['array'] == INUNDATED_VALUE) & (coarse['array'] != coarse['nodata'])
+
+    return coarse
+
+
+def resample_block(coarse, window, ref_profile):
+    """Returns the coarse inundation mask resampled (nearest neighbour) onto one block of the reference grid."""
+    if coarse['aligned']:
+        rows, rows_inside = nearest_indices(window.row_off, window.height, ref_profile['transform'].e,
+                                            coarse['transform'].e, coarse['height'])
+        cols, cols_inside = nearest_indices(window.col_off, window.width, ref_profile['transform'].a,
+                                            coarse['transform'].a, coarse['width'])
+        return coarse['inundated'][np.ix_(rows, cols)] & rows_inside[:, None] & cols_inside[None, :]
+
+    resampled_coarse = np.empty((window.height, window.width), dtype=coarse['resampled_dtype'])
+    reproject(
+        source=coarse['array'],
+        destination=resampled_coarse,
+        src_transform=coarse['transform'],
+        src_crs=coarse['crs'],
+        dst_transform=windows.transform(window, ref_profile['transform']),
+        dst_crs=ref_profile['crs'],
+        src_nodata=coarse['nodata'],
+        dst_nodata=coarse['resampled_nodata'],
+        resampling=Resampling.nearest
+    )
+    return resampled_coarse == INUNDATED_VALUE
+
+
+def inundation_stats(res, tp_count, fn_count, fp_count, pixel_area):
+    """Builds the statistics row of one coarse raster."""
+    # Every inundated reference pixel is either a TP or a FN
+    total_inundated_pixels = tp_count + fn_count
+
+    return {
+        'Resolution': res,
+        'True Positives': tp_count,
+        'False Negatives': fn_count,
+        'False Positives': fp_count,
+        'TP Area (m²)': tp_count * pixel_area,
+        'FN Area (m²)': fn_count * pixel_area,
+        'FP Area (m²)': fp_count * pixel_area,
+        'TP (%)': (tp_count / total_inundated_pixels) * 100 if total_inundated_pixels > 0 else 0,
+        'FN (%)': (fn_count / total_inundated_pixels) * 100 if total_inundated_pixels > 0 else 0,
+        'FP (%)': (fp_count / total_inundated_pixels) * 100 if total_inundated_pixels > 0 else 0
+    }
+
 
 def main():
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    # Open reference raster and read data
-    with rasterio.open(REFERENCE_PATH) as ref_dst:
-        ref_profile = ref_dst.profile
-        ref_array = ref_dst.read(1)
-        ref_nodata = ref_dst.nodata if ref_dst.nodata is not None else -9999
-
-    # Mask reference array to only include inundation pixels
-    ref_mask = (ref_array == INUNDATED_VALUE)
-    total_inundated_pixels = np.sum(ref_mask)
+    # Reference raster is converted once into the output folder and then mapped straight from disk on later runs
+    ref_array, ref_profile = cache_tif_as_memmap(REFERENCE_PATH, OUTPUT_DIR)
     pixel_area = abs(ref_profile['transform'][0] * ref_profile['transform'][4])  # m² per pixel
-
-    stats = []
-
-    for coarse_path in COARSE_PATHS:
-        with rasterio.open(coarse_path) as coarse_dst:
-            res = os.path.basename(coarse_path).split('.')[0]
-            output_path = os.path.join(OUTPUT_DIR, f'classification_{res}.tif')
-
-            # Resample coarse raster to match reference raster's grid
-            resampled_coarse = np.empty_like(ref_array, dtype=np.float32)
-            reproject(
-                source=coarse_dst.read(1),
-                destination=resampled_coarse,
-                src_transform=coarse_dst.transform,
-                src_crs=coarse_dst.crs,
-                dst_transform=ref_profile['transform'],
-                dst_crs=ref_profile['crs'],
-                src_nodata=coarse_dst.nodata if coarse_dst.nodata is not None else -9999,
-                dst_nodata=-9999,
-                resampling=Resampling.nearest
-            )
-
-            # Mask valid pixels (only compare pixels that are inundated in reference)
-            valid_mask = (ref_array == INUNDATED_VALUE) & (resampled_coarse == INUNDATED_VALUE)
-            false_negatives = (ref_array == INUNDATED_VALUE) & (resampled_coarse != INUNDATED_VALUE)
-            false_positives = (ref_array != INUNDATED_VALUE) & (resampled_coarse == INUNDATED_VALUE)
-
-            # Classification raster
-            classification = np.full_like(ref_array, NODATA_CLASS, dtype=np.uint8)
-            classification[valid_mask] = 1  # True Positive
-            classification[false_negatives] = 2  # False Negative
-            classification[false_positives] = 3  # False Positive
-
-            # Save classification raster
-            profile = ref_profile.copy()
-            profile.update(dtype=rasterio.uint8, nodata=NODATA_CLASS, count=1)
-            with rasterio.open(output_path, 'w', **profile) as dst:
-                dst.write(classification, 1)
-
-            # Calculate statistics
-            tp_count = np.sum(valid_mask)
-            fn_count = np.sum(false_negatives)
-            fp_count = np.sum(false_positives)
-
-            stats.append({
-                'Resolution': res,
-                'True Positives': tp_count,
-                'False Negatives': fn_count,
-                'False Positives': fp_count,
-                'TP Area (m²)': tp_count * pixel_area,
-                'FN Area (m²)': fn_count * pixel_area,
-                'FP Area (m²)': fp_count * pixel_area,
-                'TP (%)': (tp_count / total_inundated_pixels) * 100 if total_inundated_pixels > 0 else 0,
-                'FN (%)': (fn_count / total_inundated_pixels) * 100 if total_inundated_pixels > 0 else 0,
-                'FP (%)': (fp_count / total_inundated_pixels) * 100 if total_inundated_pixels > 0 else 0
-            })
+    resolutions = [os.path.basename(coarse_path).split('.')[0] for coarse_path in COARSE_PATHS]
+
+    # Tiled, ZSTD-compressed output; the blocks also set the processing windows. All outputs are
+    # open at once and GDAL compresses their blocks in the background, so the cores are split between them
+    profile = ref_profile.copy()
+    profile.update(driver='GTiff', dtype=rasterio.uint8, nodata=NODATA_CLASS, count=1,
+                   tiled=True, blockxsize=512, blockysize=512, compress='zstd', zstd_level=3,
+                   num_threads=max(1, (os.cpu_count() or 1) // len(COARSE_PATHS)), bigtiff='IF_SAFER')
+
+    counts = np.zeros((len(COARSE_PATHS), 3), dtype=np.int64)  # TP, FN, FP per coarse raster
+
+    # Coarse rasters are independent; rasterio releases the GIL during reads and warping
+    with ThreadPoolExecutor(max_workers=len(COARSE_PATHS)) as executor, contextlib.ExitStack() as stack:
+        coarse_rasters = list(executor.map(lambda path: load_coarse(path, ref_profile), COARSE_PATHS))
+        outputs = [stack.enter_context(rasterio.open(os.path.join(OUTPUT_DIR, f'classification_{res}.tif'),
+                                                     'w', **profile))
+                   for res in resolutions]
+
+        # Single pass over the reference: each block is compared against INUNDATED_VALUE once and then
+        # classified against every coarse raster. Workers only handle arrays; dataset I/O stays in this thread
+        for _, window in outputs[0].block_windows(1):
+            ref_tile = (ref_array[window.toslices()] == INUNDATED_VALUE)
+            results = executor.map(lambda coarse: classify(ref_tile, resample_block(coarse, window, ref_profile)),
+                                   coarse_rasters)
+
+            for i, (dst, (classification, tile_tp, tile_fn, tile_fp)) in enumerate(zip(outputs, results)):
+                dst.write(classification, 1, window=window)
+                counts[i] += (tile_tp, tile_fn, tile_fp)
+
+    stats = [inundation_stats(res, *(int(count) for count in coarse_counts), pixel_area)
+             for res, coarse_counts in zip(resolutions, counts)]
 
     # Write statistics to CSV
     csv_path = os.path.join(OUTPUT_DIR, 'inundation_stats.csv')
@@ -94,8 +217,7 @@ def main():
                       'TP (%)', 'FN (%)', 'FP (%)']
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
         writer.writeheader()
-        for entry in stats:
-            writer.writerow(entry)
+        writer.writerows(stats)
 
 
 if __name__ == '__main__':
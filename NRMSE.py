@@ -1,57 +1,67 @@
 import os
+import io
 import csv
+import contextlib
+import operator
+import multiprocessing
 import rasterio
 import numpy as np
 from rasterio.enums import Resampling
-from rasterio.warp import reproject
+from rasterio.vrt import WarpedVRT
 
-def resample_raster(src_path, ref_raster):
-    """Resamples the input raster to match the resolution and extent of the reference raster using bilinear interpolation."""
-    with rasterio.open(src_path) as src:
-        data = src.read(1, masked=True)  # Read as a masked array
-
-        # Create empty array for resampled data
-        resampled_data = np.empty(ref_raster.shape, dtype=np.float32)
-
-        # Perform reprojection/resampling with bilinear
-        reproject(
-            source=data,
-            destination=resampled_data,
-            src_transform=src.transform,
-            src_crs=src.crs,
-            dst_transform=ref_raster.transform,
-            dst_crs=ref_raster.crs,
-            resampling=Resampling.bilinear
-        )
-
-        # Convert to masked array (ignoring NaN values)
-        resampled_masked = np.ma.masked_invalid(resampled_data)
-
-    return resampled_masked
+def resample_raster(src_path, ref_raster, out, mask_out):
+    """Resamples the input raster to match the resolution and extent of the reference raster using bilinear interpolation.
 
-def compute_nrmse(reference, prediction, normalization="range"):
-    """Computes the Normalized RMSE between reference and prediction rasters, expressed as a percentage."""
-    mask = ~reference.mask & ~prediction.mask  # Only compare overlapping valid data
-    ref_values = reference[mask]
-    pred_values = prediction[mask]
-
-    # Compute RMSE
-    rmse = np.sqrt(np.mean((ref_values - pred_values) ** 2))
-
-    # Choose normalization factor
+    The data is warped straight into the caller-owned float32 buffer `out` and the invalid (nodata or
+    non-finite) pixels are flagged in the boolean buffer `mask_out`, so both can be reused across predictions.
+    If `out` is smaller than the reference raster, the warped data is averaged down to its shape.
+    """
+    with rasterio.open(src_path) as src:
+        # Let GDAL warp the raster lazily onto the reference grid while it is read. The warp runs
+        # in float32 so integer predictions (e.g. int16 times) are not rounded after interpolation,
+        # and source nodata pixels are excluded from the interpolation and come out as NaN
+        with WarpedVRT(src, crs=ref_raster.crs, transform=ref_raster.transform,
+                       width=ref_raster.width, height=ref_raster.height,
+                       resampling=Resampling.bilinear, dtype='float32', nodata=np.nan) as vrt:
+            vrt.read(1, out=out, resampling=Resampling.average)
+
+    # NaN nodata and any ±inf are flagged in one pass, without a temporary
+    np.logical_not(np.isfinite(out, out=mask_out), out=mask_out)
+    return out, mask_out
+
+def normalization_factor(ref_values, normalization="range"):
+    """Computes the normalization factor of the NRMSE from the valid reference values."""
     if normalization == "range":
-        norm_factor = ref_values.max() - ref_values.min()
+        return ref_values.max() - ref_values.min()
     elif normalization == "mean":
-        norm_factor = np.mean(ref_values)
+        return np.mean(ref_values)
     elif normalization == "std":
-        norm_factor = np.std(ref_values)
+        return np.std(ref_values)
     else:
         raise ValueError("Invalid normalization method. Choose 'range', 'mean', or 'std'.")
 
+def compute_nrmse(reference, ref_mask, prediction, pred_mask, norm_factor):
+    """Computes the Normalized RMSE between reference and prediction rasters, expressed as a percentage.
+
+    The masks are boolean arrays marking invalid pixels of each raster; norm_factor comes from normalization_factor().
+    """
+    # Only compare overlapping valid data, built once as a plain boolean mask
+    valid = ~ref_mask & ~pred_mask
+
+    # Compute RMSE; the dot product squares and sums the differences in one pass
+    diff = np.subtract(reference[valid], prediction[valid], dtype=np.float64)
+    rmse = np.sqrt(np.dot(diff, diff) / diff.size)
+
     return (rmse / norm_factor) * 100  # Convert to percentage
 
-def process_nrmse(data_folder, variable_name, normalization_method="range"):
-    """Processes NRMSE for a given dataset and returns results as a list of dicts."""
+def process_nrmse(data_folder, variable_name, normalization_method="range", decimation=1):
+    """Processes NRMSE for a given dataset and returns results as a list of dicts.
+
+    A decimation above 1 compares the rasters on a grid that many times coarser, read with average
+    resampling through GDAL overviews where available. Averaging smooths out the pixel-scale errors,
+    so the decimated NRMSE is biased low and is not comparable with full-resolution values; use it
+    only to compare runs at the same decimation, and use 1 for reported results.
+    """
     reference_filename = f"Max_{variable_name}_N10m.tif"
     prediction_filenames = [
         f"Max_{variable_name}_N15m.tif",
@@ -66,9 +76,25 @@ def process_nrmse(data_folder, variable_name, normalization_method="range"):
         print(f"Error: Reference file not found: {reference_path}")
         return results
 
+    try:
+        decimation = operator.index(decimation)
+    except TypeError:
+        raise TypeError(f"Decimation must be an integer, got {decimation!r}.") from None
+
     # Read the reference raster
     with rasterio.open(reference_path) as ref_src:
-        ref_data = ref_src.read(1, masked=True)
+        if not 1 <= decimation <= min(ref_src.height, ref_src.width):
+            raise ValueError(f"Decimation must be between 1 and {min(ref_src.height, ref_src.width)}, got {decimation}.")
+        out_shape = (ref_src.height // decimation, ref_src.width // decimation)
+        ref_masked = ref_src.read(1, masked=True, out_shape=out_shape, resampling=Resampling.average)
+        ref_data, ref_mask = ref_masked.data, np.ma.getmaskarray(ref_masked) | ~np.isfinite(ref_masked.data)
+
+        # The normalization only depends on the reference, so it is computed once for all predictions
+        norm_factor = normalization_factor(ref_data[~ref_mask], normalization_method)
+
+        # Destination buffers shared by all predictions of this reference
+        pred_buf = np.empty(out_shape, dtype=np.float32)
+        pred_mask_buf = np.empty(out_shape, dtype=bool)
 
         for pred_filename in prediction_filenames:
             pred_path = os.path.join(data_folder, pred_filename)
@@ -77,8 +103,8 @@ def process_nrmse(data_folder, variable_name, normalization_method="range"):
                 print(f"Warning: Prediction file not found: {pred_path}")
                 continue
 
-            resampled_pred = resample_raster(pred_path, ref_src)
-            nrmse = compute_nrmse(ref_data, resampled_pred, normalization=normalization_method)
+            pred_data, pred_mask = resample_raster(pred_path, ref_src, pred_buf, pred_mask_buf)
+            nrmse = compute_nrmse(ref_data, ref_mask, pred_data, pred_mask, norm_factor)
 
             results.append({
                 'variable': variable_name,
@@ -104,33 +130,46 @@ datasets = [
 # Set base folder path where datasets are stored
 base_folder = "NRMSE"
 
-# Collect all results
-all_results = []
-for dataset in datasets:
+def run_one(dataset):
+    """Runs the NRMSE comparison for one dataset folder; executed in a worker process.
+
+    Returns the console output of the dataset together with its results, so the parent
+    can print each dataset's lines in one piece.
+    """
     var_folder = dataset["var_folder"]
     file_prefix = dataset["file_prefix"]
     normalization_method = dataset["normalization"]
     data_folder_path = os.path.join(base_folder, var_folder)
 
-    print(f"\n===== Processing {var_folder.capitalize()} Dataset =====")
-    results = process_nrmse(data_folder_path, file_prefix, normalization_method)
-    all_results.extend(results)
-
-# Save results to CSV
-csv_filename = "nrmse_results.csv"
-with open(csv_filename, 'w', newline='') as csvfile:
-    fieldnames = ['variable', 'prediction_file', 'nrmse', 'normalization_method']
-    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-    writer.writeheader()
-
-    for result in all_results:
-        # Format NRMSE to 2 decimal places with percentage sign
-        formatted_result = {
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        print(f"\n===== Processing {var_folder.capitalize()} Dataset =====")
+        results = process_nrmse(data_folder_path, file_prefix, normalization_method)
+    return log.getvalue(), results
+
+if __name__ == '__main__':
+    # Datasets are independent; each worker process opens its own rasterio handles
+    with multiprocessing.Pool(min(len(datasets), os.cpu_count() or 1)) as pool:
+        outputs = pool.map(run_one, datasets)
+
+    all_results = []
+    for log, results in outputs:
+        print(log, end="")
+        all_results.extend(results)
+
+    # Save results to CSV
+    csv_filename = "nrmse_results.csv"
+    with open(csv_filename, 'w', newline='') as csvfile:
+        fieldnames = ['variable', 'prediction_file', 'nrmse', 'normalization_method']
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+
+        # Format NRMSE to 2 decimal places with percentage sign; rows are written in one batch
+        writer.writerows({
             'variable': result['variable'],
             'prediction_file': result['prediction_file'],
             'nrmse': f"{result['nrmse']:.2f}%",
             'normalization_method': result['normalization_method']
-        }
-        writer.writerow(formatted_result)
+        } for result in all_results)
 
-print(f"\nResults saved to {csv_filename}")
\ No newline at end of file
+    print(f"\nResults saved to {csv_filename}")
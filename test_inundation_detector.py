@@ -0,0 +1,147 @@
+import csv
+import os
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+import Inundation_detector as detector
+
+CRS = 'EPSG:32633'
+ORIGIN = (500000, 4000000)
+
+
+def write_raster(path, array, transform, nodata):
+    with rasterio.open(path, 'w', driver='GTiff', height=array.shape[0], width=array.shape[1], count=1,
+                       dtype=array.dtype, crs=CRS, transform=transform, nodata=nodata) as dst:
+        dst.write(array, 1)
+
+
+def run_main(tmp_path, monkeypatch, coarse_path, aligned):
+    """Runs main() on the test reference, forcing either the aligned or the reproject path."""
+    output_dir = tmp_path / ('aligned' if aligned else 'reproject')
+    monkeypatch.setattr(detector, 'REFERENCE_PATH', str(tmp_path / 'reference_10m.tif'))
+    monkeypatch.setattr(detector, 'COARSE_PATHS', [str(coarse_path)])
+    monkeypatch.setattr(detector, 'OUTPUT_DIR', str(output_dir))
+    monkeypatch.setattr(detector, 'is_aligned', lambda *args: aligned)
+
+    detector.main()
+    with rasterio.open(output_dir / f'classification_{coarse_path.stem}.tif') as dst:
+        return (output_dir / 'inundation_stats.csv').read_text(), dst.read(1)
+
+
+@pytest.mark.parametrize('resolution', [15, 20, 30])
+@pytest.mark.parametrize('scale', [0.5, 1.2])
+@pytest.mark.parametrize('dtype', [np.uint8, np.float32])
+def test_aligned_path_matches_reproject(tmp_path, monkeypatch, resolution, scale, dtype):
+    rng = np.random.default_rng(resolution)
+    height, width = 700, 900
+    write_raster(tmp_path / 'reference_10m.tif', rng.integers(0, 2, (height, width)).astype(np.uint8),
+                 from_origin(*ORIGIN, 10, 10), nodata=None)
+
+    # Coarse rasters that cover only part of the reference grid, or more than all of it
+    coarse_shape = (int(height * 10 * scale) // resolution, int(width * 10 * scale) // resolution)
+    coarse_path = tmp_path / f'prediction_{resolution}m.tif'
+    coarse = rng.integers(0, 3, coarse_shape).astype(dtype)
+    if dtype == np.float32:
+        # Fractional values must not be rounded into the inundated class
+        coarse[rng.random(coarse_shape) < 0.3] = 0.6
+    write_raster(coarse_path, coarse, from_origin(*ORIGIN, resolution, resolution), nodata=0)
+
+    with rasterio.open(coarse_path) as coarse_dst, rasterio.open(tmp_path / 'reference_10m.tif') as ref_dst:
+        assert detector.is_aligned(coarse_dst, ref_dst.profile)
+
+    aligned_stats, aligned_classes = run_main(tmp_path, monkeypatch, coarse_path, aligned=True)
+    warped_stats, warped_classes = run_main(tmp_path, monkeypatch, coarse_path, aligned=False)
+
+    np.testing.assert_array_equal(aligned_classes, warped_classes)
+    assert aligned_stats == warped_stats
+
+
+def test_south_up_raster_is_not_aligned(tmp_path):
+    write_raster(tmp_path / 'reference_10m.tif', np.zeros((4, 4), np.uint8), from_origin(*ORIGIN, 10, 10), nodata=None)
+    south_up = rasterio.Affine(15, 0, ORIGIN[0], 0, 15, ORIGIN[1])
+    write_raster(tmp_path / 'prediction_15m.tif', np.zeros((5, 5), np.uint8), south_up, nodata=None)
+
+    with rasterio.open(tmp_path / 'prediction_15m.tif') as coarse_dst, \
+            rasterio.open(tmp_path / 'reference_10m.tif') as ref_dst:
+        assert not detector.is_aligned(coarse_dst, ref_dst.profile)
+
+
+def test_nearest_indices_flags_negative_indices_outside():
+    indices, inside = detector.nearest_indices(0, 4, -10, 15, 5)
+    assert not inside.any()
+    assert (indices >= 0).all()
+
+
+def test_cache_ignores_interrupted_write(tmp_path):
+    reference = np.ones((6, 8), np.uint8)
+    write_raster(tmp_path / 'reference_10m.tif', reference, from_origin(*ORIGIN, 10, 10), nodata=None)
+    cache_dir = tmp_path / 'cache'
+    cache_dir.mkdir()
+
+    # A run that died while filling the array leaves only the temporary file behind
+    (cache_dir / 'reference_10m.tif.npy.tmp').write_bytes(b'')
+
+    cached, profile = detector.cache_tif_as_memmap(str(tmp_path / 'reference_10m.tif'), str(cache_dir))
+    np.testing.assert_array_equal(cached, reference)
+    assert profile['transform'] == from_origin(*ORIGIN, 10, 10)
+
+    cached, profile = detector.cache_tif_as_memmap(str(tmp_path / 'reference_10m.tif'), str(cache_dir))
+    np.testing.assert_array_equal(cached, reference)
+    assert profile['transform'] == from_origin(*ORIGIN, 10, 10)
+    assert sorted(p.name for p in cache_dir.iterdir()) == ['reference_10m.tif.json', 'reference_10m.tif.npy']
+
+
+def test_cache_rebuilds_when_reference_is_replaced_by_older_file(tmp_path):
+    reference_path = tmp_path / 'reference_10m.tif'
+    write_raster(reference_path, np.ones((6, 8), np.uint8), from_origin(*ORIGIN, 10, 10), nodata=None)
+    cache_dir = tmp_path / 'cache'
+    cache_dir.mkdir()
+    cached, _ = detector.cache_tif_as_memmap(str(reference_path), str(cache_dir))
+    np.testing.assert_array_equal(cached, 1)
+    del cached
+
+    # Unzipping new data keeps the archive's timestamps, which are older than the cache
+    write_raster(reference_path, np.zeros((6, 8), np.uint8), from_origin(*ORIGIN, 10, 10), nodata=None)
+    os.utime(reference_path, ns=(1_000_000_000, 1_000_000_000))
+
+    cached, _ = detector.cache_tif_as_memmap(str(reference_path), str(cache_dir))
+    np.testing.assert_array_equal(cached, 0)
+
+
+def test_main_counts_every_coarse_raster_in_one_pass(tmp_path, monkeypatch):
+    rng = np.random.default_rng(0)
+    reference = rng.integers(0, 2, (600, 700)).astype(np.uint8)
+    write_raster(tmp_path / 'reference_10m.tif', reference, from_origin(*ORIGIN, 10, 10), nodata=None)
+
+    # 20 m rasters covering the reference exactly, so the expected classes are plain block expansions
+    coarse_rasters = [rng.integers(0, 2, (300, 350)).astype(np.uint8) for _ in range(3)]
+    coarse_paths = []
+    for i, coarse in enumerate(coarse_rasters):
+        coarse_paths.append(str(tmp_path / f'prediction_{i}.tif'))
+        write_raster(coarse_paths[-1], coarse, from_origin(*ORIGIN, 20, 20), nodata=255)
+
+    monkeypatch.setattr(detector, 'REFERENCE_PATH', str(tmp_path / 'reference_10m.tif'))
+    monkeypatch.setattr(detector, 'COARSE_PATHS', coarse_paths)
+    monkeypatch.setattr(detector, 'OUTPUT_DIR', str(tmp_path / 'output'))
+    detector.main()
+
+    with open(tmp_path / 'output' / 'inundation_stats.csv', newline='') as f:
+        rows = list(csv.DictReader(f))
+
+    ref_mask = reference == 1
+    for i, (coarse, row) in enumerate(zip(coarse_rasters, rows)):
+        coarse_mask = coarse.repeat(2, axis=0).repeat(2, axis=1) == 1
+        expected = np.full(reference.shape, detector.NODATA_CLASS, np.uint8)
+        expected[ref_mask & coarse_mask] = 1
+        expected[ref_mask & ~coarse_mask] = 2
+        expected[~ref_mask & coarse_mask] = 3
+
+        with rasterio.open(tmp_path / 'output' / f'classification_prediction_{i}.tif') as dst:
+            np.testing.assert_array_equal(dst.read(1), expected)
+        assert row['Resolution'] == f'prediction_{i}'
+        assert int(row['True Positives']) == np.count_nonzero(ref_mask & coarse_mask)
+        assert int(row['False Negatives']) == np.count_nonzero(ref_mask & ~coarse_mask)
+        assert int(row['False Positives']) == np.count_nonzero(~ref_mask & coarse_mask)
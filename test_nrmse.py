@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+import NRMSE as nrmse
+
+CRS = 'EPSG:32633'
+ORIGIN = (500000, 4000000)
+PREDICTION_VALUE = 2.5
+
+
+def write_raster(path, array, resolution, nodata):
+    with rasterio.open(path, 'w', driver='GTiff', height=array.shape[0], width=array.shape[1], count=1,
+                       dtype=array.dtype, crs=CRS, transform=from_origin(*ORIGIN, resolution, resolution),
+                       nodata=nodata) as dst:
+        dst.write(array, 1)
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    """A 10 m reference with random values and constant 15/20/30 m predictions covering the same extent."""
+    reference = np.random.default_rng(0).random((60, 90)).astype(np.float32) * 4
+    write_raster(tmp_path / 'Max_depth_N10m.tif', reference, 10, nodata=-9999)
+    for resolution in (15, 20, 30):
+        shape = (600 // resolution, 900 // resolution)
+        write_raster(tmp_path / f'Max_depth_N{resolution}m.tif', np.full(shape, PREDICTION_VALUE, np.float32),
+                     resolution, nodata=-9999)
+    return tmp_path, reference
+
+
+def test_normalization_factor():
+    ref_values = np.array([1, 2, 3, 4], np.float32)
+    assert nrmse.normalization_factor(ref_values, "range") == 3
+    assert nrmse.normalization_factor(ref_values, "mean") == pytest.approx(2.5)
+    assert nrmse.normalization_factor(ref_values, "std") == pytest.approx(np.sqrt(1.25))
+    with pytest.raises(ValueError):
+        nrmse.normalization_factor(ref_values, "median")
+
+
+def test_compute_nrmse_skips_masked_prediction_pixels():
+    reference = np.array([[1, 2], [3, 4]], np.float32)
+    ref_mask = np.zeros((2, 2), bool)
+    prediction = np.array([[2, 2], [3, -9999]], np.float32)
+    pred_mask = np.array([[False, False], [False, True]])
+
+    # Only the three valid pixels count: errors (-1, 0, 0), normalized by the reference range of 3
+    result = nrmse.compute_nrmse(reference, ref_mask, prediction, pred_mask, norm_factor=3)
+    assert result == pytest.approx(100 * np.sqrt(1 / 3) / 3)
+
+
+def test_resample_raster_excludes_prediction_nodata(dataset):
+    folder, reference = dataset
+    prediction = np.full((30, 45), PREDICTION_VALUE, np.float32)
+    prediction[10:20, 10:20] = -9999
+    write_raster(folder / 'Max_depth_N20m.tif', prediction, 20, nodata=-9999)
+
+    out = np.empty(reference.shape, np.float32)
+    mask_out = np.empty(reference.shape, bool)
+    with rasterio.open(folder / 'Max_depth_N10m.tif') as ref_src:
+        nrmse.resample_raster(str(folder / 'Max_depth_N20m.tif'), ref_src, out, mask_out)
+
+    # Nodata is masked and never blended into the bilinear values next to it
+    assert mask_out[22:38, 22:38].all()
+    np.testing.assert_allclose(out[~mask_out], PREDICTION_VALUE)
+
+
+def test_process_nrmse_at_full_resolution(dataset):
+    folder, reference = dataset
+    results = nrmse.process_nrmse(str(folder), 'depth')
+
+    # Bilinear interpolation of a constant prediction is that constant everywhere
+    expected = np.sqrt(np.mean((reference.astype(np.float64) - PREDICTION_VALUE) ** 2)) / np.ptp(reference) * 100
+    assert [result['prediction_file'] for result in results] == [
+        'Max_depth_N15m.tif', 'Max_depth_N20m.tif', 'Max_depth_N30m.tif']
+    for result in results:
+        assert result['nrmse'] == pytest.approx(expected, rel=1e-5)
+
+
+@pytest.mark.parametrize('decimation', [0, -1, 61])
+def test_process_nrmse_rejects_out_of_range_decimation(dataset, decimation):
+    folder, _ = dataset
+    with pytest.raises(ValueError):
+        nrmse.process_nrmse(str(folder), 'depth', decimation=decimation)
+
+
+def test_process_nrmse_rejects_non_integer_decimation(dataset):
+    folder, _ = dataset
+    with pytest.raises(TypeError):
+        nrmse.process_nrmse(str(folder), 'depth', decimation=2.5)